@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Iterable, Optional, List, Tuple
+
+
+def user_cache_dir() -> Path:
+    """Returns the directory where chkpkg keeps the data reused between
+    runs. The location can be overridden by the `CHKPKG_CACHE_DIR`
+    environment variable."""
+    override = os.environ.get('CHKPKG_CACHE_DIR')
+    if override:
+        return Path(override)
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or \
+               os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+        return Path(base) / 'chkpkg' / 'Cache'
+    if sys.platform == 'darwin':
+        return Path.home() / 'Library' / 'Caches' / 'chkpkg'
+    base = os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base) / 'chkpkg'
+
+
+@contextmanager
+def file_lock(lock_file: Path) -> Iterator[None]:
+    """Exclusive inter-process lock. Serializes the chkpkg processes that
+    modify the same cached data."""
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_file, 'a+b') as f:
+        if sys.platform == 'win32':
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    # LK_LOCK gives up after 10 attempts, so we repeat
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# the dirs that are the build output or the tool caches. They do not affect
+# the wheel
+# skipped at any depth
+_NOT_SOURCE_DIRS = frozenset([
+    '.git', '.hg', '.svn', '__pycache__', '.mypy_cache', '.pytest_cache'])
+
+# skipped only in the root: a package may have a subpackage named "build"
+_NOT_SOURCE_ROOT_DIRS = frozenset([
+    'build', 'dist', 'venv', '.venv', '.tox', '.nox'])
+
+
+def tree_fingerprint(root: str, extra: Iterable[str] = ()) -> str:
+    """Returns a hash of the paths, sizes and modification times of the
+    files in the `root` tree, and the `extra` strings. The contents are not
+    read, so the fingerprint is cheap even for large trees."""
+    files: List[Tuple[str, int, int]] = []
+    stack = [root]
+    while stack:
+        dir_path = stack.pop()
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if not (entry.name in _NOT_SOURCE_DIRS
+                            or entry.name.endswith('.egg-info')
+                            or (entry.name in _NOT_SOURCE_ROOT_DIRS
+                                and dir_path == root)):
+                        stack.append(entry.path)
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                files.append((os.path.relpath(entry.path, root),
+                              st.st_size, st.st_mtime_ns))
+    h = hashlib.blake2b(digest_size=16)
+    for item in extra:
+        h.update(item.encode('utf-8') + b'\0')
+    for rel, size, mtime in sorted(files):
+        line = f'{rel}\0{size}\0{mtime}\n'
+        h.update(line.encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+
+def cached_wheel(key: str) -> Optional[str]:
+    """Returns the wheel stored by `store_wheel` with the same key."""
+    wheel_dir = user_cache_dir() / 'wheels' / key
+    try:
+        with os.scandir(wheel_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.whl'):
+                    return entry.path
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def store_wheel(key: str, whl: str) -> None:
+    """Copies the wheel to the cache. The file name is kept, since pip
+    parses it."""
+    wheel_dir = user_cache_dir() / 'wheels' / key
+    temp_dir = Path(f'{wheel_dir}.tmp{os.getpid()}')
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(whl, str(temp_dir))
+    try:
+        # atomic, so a concurrent run sees the wheel complete or not at all
+        os.rename(temp_dir, wheel_dir)
+    except OSError:
+        # another run stored it first
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -1,6 +1,86 @@
+import os
 import shutil
+import stat
+import subprocess
+import sys
+import threading
 from pathlib import Path
-from typing import Iterator
+from typing import List, Union, Optional
+
+
+def _chmod_and_retry(func, path, _=None):
+    # read-only files cannot be deleted on Windows. We make them writable
+    # and try again, so such files do not linger in the project dir
+    try:
+        os.chmod(path, stat.S_IWRITE | stat.S_IREAD | stat.S_IEXEC)
+        func(path)
+    except OSError:
+        pass
+
+
+def _is_real_dir(entry: os.DirEntry) -> bool:
+    if not entry.is_dir(follow_symlinks=False):
+        return False
+    if sys.platform == 'win32':
+        # junctions look like directories, but we must not walk into them
+        attrs = entry.stat(follow_symlinks=False).st_file_attributes
+        return not attrs & stat.FILE_ATTRIBUTE_REPARSE_POINT
+    return True
+
+
+def _remove(func, path: str) -> None:
+    try:
+        func(path)
+    except OSError:
+        _chmod_and_retry(func, path)
+
+
+def rmtree(path: Union[str, Path]) -> None:
+    """Like `shutil.rmtree`, but retries removing read-only files and
+    ignores other errors.
+
+    The tree is walked iteratively with `os.scandir`, so the type of each
+    entry comes from the cached `DirEntry` data without extra `stat` calls.
+    """
+    stack = [os.fspath(path)]
+    dirs: List[str] = []
+    while stack:
+        current = stack.pop()
+        dirs.append(current)
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if _is_real_dir(entry):
+                        stack.append(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        # a junction: removing it leaves the target intact
+                        _chmod_and_retry(os.rmdir, entry.path)
+                    else:
+                        _remove(os.unlink, entry.path)
+        except OSError:
+            pass
+    # children were appended after their parents
+    for d in reversed(dirs):
+        _remove(os.rmdir, d)
+
+
+def remove_dirs(paths: List[Union[str, Path]]) -> None:
+    """Removes the directories with all their contents. Missing directories
+    are ignored.
+
+    On POSIX all the directories are removed by a single `rm -rf` call, so
+    the tree walk is done by native code instead of Python frames."""
+    if not paths:
+        return
+    rm = shutil.which('rm') if os.name != 'nt' else None
+    if rm is not None:
+        # on POSIX, close_fds=False and the absolute path of rm let
+        # subprocess use posix_spawn instead of fork+exec
+        subprocess.run([rm, '-rf', '--'] + [str(p) for p in paths],
+                       check=False, close_fds=(os.name == 'nt'))
+    else:
+        for p in paths:
+            rmtree(p)
 
 
 class BuildCleaner:
@@ -9,38 +89,67 @@ class BuildCleaner:
 
     def __init__(self, project_dir: Path):
         self.project_dir = project_dir.absolute()
-        self._build_existed = self.build_dir.exists()
-        self._distr_existed = self.distr_dir.exists()
-        self._eggs_existed = list(self.egg_infos)
-
-    @property
-    def build_dir(self) -> Path:
-        return self.project_dir / "build"
-
-    @property
-    def distr_dir(self) -> Path:
-        return self.project_dir / "distr"
+        # plain strings are accepted by everything downstream, so we compute
+        # them once instead of building new Path objects on every access
+        self.build_dir: str = os.path.join(self.project_dir, "build")
+        self.distr_dir: str = os.path.join(self.project_dir, "distr")
+        # directories that did not exist before, so whatever appears there
+        # later is created by the build
+        self._to_remove: List[str] = [
+            d for d in (self.build_dir, self.distr_dir)
+            if not os.path.isdir(d)]
+        self._eggs_existed = set(self.egg_infos)
+        self._remover: Optional[threading.Thread] = None
 
     @property
-    def egg_infos(self) -> Iterator[Path]:
-        return self.project_dir.glob('*.egg-info')
+    def egg_infos(self) -> List[str]:
+        # os.scandir gives us the cached DirEntry type info, so we do not
+        # need a stat() call and a Path object per directory entry.
+        # The list is computed anew each time: cleanup() needs the state
+        # after the build
+        try:
+            with os.scandir(self.project_dir) as it:
+                return [e.path for e in it
+                        if e.name.endswith('.egg-info')
+                        and e.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return []
 
     def cleanup(self):
+        """Moves the directories out of the way and removes them in
+        a background thread. Renaming is a single operation, so the
+        directories are gone for the caller right away."""
+        new_eggs = [egg for egg in self.egg_infos
+                    if egg not in self._eggs_existed]
 
-        def remove(p: Path):
-            shutil.rmtree(p, ignore_errors=True)
+        trash: List[Union[str, Path]] = []
+        for i, path in enumerate(self._to_remove + new_eggs):
+            if not os.path.exists(path):
+                continue
+            parent, name = os.path.split(path)
+            moved = os.path.join(
+                parent, f".{name}.chkpkg_trash_{os.getpid()}_{i}")
+            try:
+                os.rename(path, moved)
+            except OSError:
+                # for example, a file inside is locked on Windows
+                moved = path
+            trash.append(moved)
 
-        if not self._build_existed:
-            remove(self.build_dir)
-        if not self._distr_existed:
-            remove(self.distr_dir)
+        if trash:
+            # not a daemon: the interpreter will wait for the thread before
+            # exiting, so the moved directories do not remain
+            self._remover = threading.Thread(target=remove_dirs,
+                                             args=(trash,))
+            self._remover.start()
 
-        for egg in self.egg_infos:
-            if egg not in self._eggs_existed:
-                remove(egg)
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Waits until the background removal is finished."""
+        if self._remover is not None:
+            self._remover.join(timeout)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.cleanup()
\ No newline at end of file
+        self.cleanup()
@@ -0,0 +1,9 @@
+# SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
+# SPDX-License-Identifier: MIT
+
+import sys
+
+# the subprocesses print to our stdout, so we decode their output the same
+# way. Not forcing UTF-8: cmd.exe prints with the console code page.
+# sys.stdout is None in the GUI apps on Windows (pythonw)
+STDOUT_ENCODING = getattr(sys.stdout, 'encoding', None) or 'utf-8'
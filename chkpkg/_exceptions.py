@@ -15,7 +15,7 @@ class ChkpkgException(Exception):
     def __str__(self):
         return "\n".join(
             [super().__str__()]
-            + [f"inner: {self.inner}"] if self.inner else [])
+            + ([f"inner: {self.inner}"] if self.inner else []))
 
 
 class CompletedProcessError(ChkpkgException):
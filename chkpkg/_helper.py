@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
+# SPDX-License-Identifier: MIT
+
+import os
+from pathlib import Path
+from subprocess import Popen, PIPE
+from typing import Optional, Dict, Tuple, Union
+
+# runs in the helper process. Reads the code blocks prefixed by their length
+# from stdin, executes each in a fresh namespace, and replies with the exit
+# status and the printed text.
+#
+# The protocol uses duplicates of fd 0 and fd 1. The fds themselves are
+# replaced before running any code: fd 0 with devnull, so input() fails
+# instead of reading the protocol, and fd 1 with stderr, so the processes
+# started by the code and the writes to sys.__stdout__ do not get into the
+# replies
+_HELPER_CODE = r'''
+import io, os, sys, traceback
+inp = os.fdopen(os.dup(0), 'rb')
+out = os.fdopen(os.dup(1), 'wb')
+devnull = os.open(os.devnull, os.O_RDONLY)
+os.dup2(devnull, 0)
+os.close(devnull)
+os.dup2(2, 1)
+while True:
+    header = inp.readline()
+    if not header:
+        break
+    code = inp.read(int(header)).decode('utf-8')
+    buf = io.StringIO()
+    sys.stdout = sys.stderr = buf
+    status = 0
+    try:
+        exec(compile(code, '<string>', 'exec'), {'__name__': '__main__'})
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            status = e.code or 0
+        else:
+            print(e.code)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    data = buf.getvalue().encode('utf-8', 'replace')
+    out.write(b'%d %d\n' % (status, len(data)))
+    out.write(data)
+    out.flush()
+'''
+
+
+class PythonHelper:
+    """A long-lived interpreter that executes the code sent to it. Running
+    the code this way costs a pipe round-trip instead of starting a new
+    interpreter.
+
+    Only the text printed through `sys.stdout` and `sys.stderr` is
+    returned. What is written to fd 1 directly (for example, by a child
+    process) goes to stderr of the helper. stdin is empty. The modules
+    imported by the previous code remain imported. If the interpreter exits,
+    it is restarted by the next `run`."""
+
+    def __init__(self, python_exe: str, cwd: Union[str, Path],
+                 env: Optional[Dict[str, str]] = None):
+        self.python_exe = python_exe
+        self.cwd = cwd
+        self.env = env
+        self._process: Optional[Popen] = None
+
+    def _start(self) -> Popen:
+        if self._process is not None and self._process.poll() is not None:
+            self.close()
+        if self._process is None:
+            self._process = Popen([self.python_exe, '-c', _HELPER_CODE],
+                                  stdin=PIPE, stdout=PIPE, cwd=self.cwd,
+                                  env=self.env,
+                                  close_fds=(os.name == 'nt'))
+        return self._process
+
+    def run(self, code: str) -> Tuple[int, str]:
+        """Returns the exit status of the code and what it printed."""
+        process = self._start()
+        assert process.stdin is not None and process.stdout is not None
+        data = code.encode('utf-8')
+        try:
+            process.stdin.write(b'%d\n' % len(data))
+            process.stdin.write(data)
+            process.stdin.flush()
+            header = process.stdout.readline()
+        except BrokenPipeError:
+            header = b''
+        if not header:
+            # the code terminated the interpreter
+            return self.close() or 1, ''
+        status, length = map(int, header.split())
+        output = process.stdout.read(length).decode('utf-8')
+        return status, output
+
+    def close(self) -> Optional[int]:
+        """Stops the interpreter and returns its exit code."""
+        process, self._process = self._process, None
+        if process is None:
+            return None
+        assert process.stdin is not None and process.stdout is not None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+        process.stdout.close()
+        return returncode
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,27 @@
+# SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
+# SPDX-License-Identifier: MIT
+
+import sys
+import threading
+
+# the installer venv is prepared by a thread while the main thread builds,
+# so both write the log at the same time. print() writes the text and the
+# line end separately, and the lines of two threads could get mixed. Each
+# write here is a whole line or a whole banner, made under the lock
+_lock = threading.Lock()
+
+
+def write_stdout(text: str, flush: bool = False) -> None:
+    # sys.stdout is None in the GUI apps on Windows (pythonw). print() does
+    # nothing then, and so does this
+    if sys.stdout is None:
+        return
+    with _lock:
+        sys.stdout.write(text)
+        if flush:
+            sys.stdout.flush()
+
+
+def print_line(text: str) -> None:
+    """Like print(text), but safe to call from several threads."""
+    write_stdout(text + '\n')
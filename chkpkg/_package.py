@@ -1,41 +1,168 @@
 # SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
 # SPDX-License-Identifier: MIT
+import hashlib
 import os
+import re
 import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import lru_cache
 from pathlib import Path
-from subprocess import run as run_process, PIPE, STDOUT, \
+from queue import Queue
+from subprocess import run as run_process, Popen, PIPE, STDOUT, DEVNULL, \
     CompletedProcess
 from tempfile import TemporaryDirectory
-from typing import Optional, List, Union, Type, Any
-
-from ._cleaner import BuildCleaner
+from typing import Optional, List, Union, Type, Any, Tuple, Dict, \
+    Sequence
+
+from ._constants import __version__
+from ._cleaner import BuildCleaner, rmtree
+from ._encoding import STDOUT_ENCODING
+from ._helper import PythonHelper
+from ._output import write_stdout, print_line
 from ._exceptions import TwineCheckFailed, FailedToInstallPackage, \
-    CannotInitializeEnvironment, CodeExecutionFailed, CompletedProcessError
-from ._require_pytyped import get_module_path, require_dir_contains_pytyped
-from ._venvs import TempVenv
+    CannotInitializeEnvironment, CodeExecutionFailed, CompletedProcessError, \
+    PytypedNotFound
+from ._require_pytyped import find_pytyped
+from ._cache import user_cache_dir, tree_fingerprint, cached_wheel, \
+    store_wheel
+from ._venvs import TempVenv, CachedVenv, ram_temp_dir, shared_temp_venv
 
 
-def print_command(cmd: Union[str, List[str]], title: str, at: str):
-    print()
-    print('== ' + title.upper() + ' ' +
-          ('=' * (80 - len(at) - len(title) - 4 - 4)) +
-          ' ' + at + ' ==')
-    if isinstance(cmd, str):
-        print(cmd)
-    else:
-        print(' '.join(repr(arg) for arg in cmd))
-    print('=' * 80)
-    print()
+# packages installed into the builder venv
+BUILDER_REQUIREMENTS = ('pip', 'build', 'twine')
+
+# with no build isolation, the build backend must be in the builder venv
+# itself
+NO_ISOLATION_REQUIREMENTS = BUILDER_REQUIREMENTS + ('setuptools', 'wheel')
+
+# the installer venv gets pip upgraded only if its pip is older
+MIN_PIP = (23, 0)
 
+# pip settings for the non-interactive runs: no network request checking
+# for a newer pip, no progress bars filling the log, and a failure
+# instead of waiting for input. The values set by the user take precedence
+_PIP_ENV = {
+    'PIP_DISABLE_PIP_VERSION_CHECK': '1',
+    'PIP_PROGRESS_BAR': 'off',
+    'PIP_NO_INPUT': '1',
+}
 
-def find_latest_wheel(parent_dir: Path) -> Path:
+_EQ80 = '=' * 80
+_BANNER = '\n== {title} {pad} {at} ==\n{cmd}\n' + _EQ80 + '\n\n'
+
+
+def print_command(cmd: Union[str, List[str]], title: str, at: str):
+    # a single write instead of five prints, so the banner does not get
+    # interleaved with the output of a parallel thread. Flushing makes the
+    # banner appear before the command starts producing output
+    if not isinstance(cmd, str):
+        cmd = ' '.join(map(repr, cmd))
+    write_stdout(_BANNER.format(
+        title=title.upper(),
+        pad=_EQ80[:max(0, 80 - len(at) - len(title) - 4 - 4)],
+        at=at,
+        cmd=cmd), flush=True)
+
+
+def find_latest_wheel(parent_dir: Union[str, Path]) -> str:
     """Finds *.whl file with the latest modification time"""
-    files = [(f.stat().st_mtime, f) for f in parent_dir.glob('*.whl')]
-    if not files:
+    best: Optional[str] = None
+    best_mtime = -1.0
+    with os.scandir(parent_dir) as it:
+        for entry in it:
+            if not (entry.name.endswith('.whl')
+                    and entry.is_file(follow_symlinks=False)):
+                continue
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+            if mtime > best_mtime:
+                best, best_mtime = entry.path, mtime
+    if best is None:
         raise FileNotFoundError(".whl file not found")
-    max_mod_time = max((mt for mt, _ in files))
-    max_mod_time_file = next(f for t, f in files if t == max_mod_time)
-    return max_mod_time_file
+    return best
+
+
+def built_wheel(build_output: str, outdir: str) -> Optional[str]:
+    """Returns the path of the wheel that `python -m build` reported as
+    built, or None if there is no such report in the output or the file
+    does not exist."""
+    for line in reversed(build_output.splitlines()):
+        if line.startswith('Successfully built ') and line.endswith('.whl'):
+            # the line may list the sdist as well: "X.tar.gz and X.whl"
+            name = line.rpartition(' ')[2]
+            path = os.path.join(outdir, name)
+            return path if os.path.isfile(path) else None
+    return None
+
+
+def pip_version(python_exe: str) -> Optional[Tuple[int, ...]]:
+    """Returns the version of pip installed for the interpreter, like
+    (23, 2, 1). Returns None if it cannot be determined."""
+    cp = run_process([python_exe, '-m', 'pip', '--version'],
+                     stdout=PIPE, stderr=DEVNULL, universal_newlines=True,
+                     close_fds=(os.name == 'nt'))
+    # "pip 23.2.1 from /path/to/pip (python 3.11)"
+    m = re.match(r'pip (\d+(?:\.\d+)*)', cp.stdout or '')
+    if cp.returncode != 0 or m is None:
+        return None
+    return tuple(int(x) for x in m.group(1).split('.'))
+
+
+def pip_cache_args() -> List[str]:
+    """Returns the pip arguments pointing it to a persistent cache
+    directory. The default pip cache may be missing or not writable in CI
+    sandboxes. The variables that configure the cache explicitly are
+    respected."""
+    if 'PIP_CACHE_DIR' in os.environ or 'PIP_NO_CACHE_DIR' in os.environ:
+        return []
+    return ['--cache-dir', str(user_cache_dir() / 'pip')]
+
+
+def _enlarge_pipe(fd: int) -> None:
+    # with a larger pipe buffer, a chatty child (pip, build) stalls less
+    # waiting for us to read the output
+    if sys.platform.startswith('linux'):
+        import fcntl
+        set_size = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+        try:
+            fcntl.fcntl(fd, set_size, 1 << 20)
+        except OSError:
+            pass  # more than /proc/sys/fs/pipe-max-size
+
+
+def pip_env(env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Returns a copy of `env` (by default, of the current environment)
+    with the pip settings added."""
+    result = dict(env if env is not None else os.environ)
+    for key, value in _PIP_ENV.items():
+        result.setdefault(key, value)
+    return result
+
+
+def _ensure_recent_pip(runner: 'Runner'):
+    # upgrading pip needs network and reinstalls pip itself, so we do
+    # not do it when the bundled pip is recent enough
+    pip_ver = pip_version(runner.python_exe)
+    if pip_ver is not None and pip_ver >= MIN_PIP:
+        print_line(f"pip {'.'.join(map(str, pip_ver))} is recent enough")
+    else:
+        runner.python(['-m', 'pip', 'install', '--disable-pip-version-check',
+                       '--prefer-binary', *pip_cache_args(),
+                       '--upgrade', 'pip'],
+                      title='Upgrading pip',
+                      exception=CannotInitializeEnvironment,
+                      env=pip_env(runner.env))
+
+
+@lru_cache(maxsize=None)
+def installer_template() -> CachedVenv:
+    """The installer venvs are copies of this cached one, so pip is not
+    bootstrapped for each of them. Created on the first call: the cache
+    key hashes files, and importing chkpkg should not do that."""
+    return CachedVenv(
+        'installer', ('pip',),
+        setup=lambda python_exe: _ensure_recent_pip(
+            Runner(python_exe, at='installer template', env=pip_env())))
 
 
 class Runner:
@@ -43,19 +170,24 @@ class Runner:
     Runs python commands with the same executable.
     """
 
-    def __init__(self, python_exe, at):
+    def __init__(self, python_exe, at,
+                 env: Optional[Dict[str, str]] = None):
         self.python_exe = python_exe
         self.at = at
+        # the environment for the commands that do not specify their own
+        self.env = env
 
     def python(self,
-               args: Union[str, List[str]],
+               args: List[str],
                title: str,
                cwd: Union[Path, str] = None,
-               exception: Type[BaseException] = None):
+               exception: Type[BaseException] = None,
+               capture: bool = False,
+               env: Optional[Dict[str, str]] = None):
 
-        args_list = args.split() if isinstance(args, str) else args
-        args_list = [self.python_exe] + args_list
-        return self._run(args_list, title, cwd, exception)
+        args_list = [self.python_exe, *args]
+        return self._run(args_list, title, cwd, exception, capture=capture,
+                         env=env)
 
     def command(self,
                 args: Union[str, List[str]],
@@ -64,11 +196,14 @@ class Runner:
                 exception: Type[BaseException] = None,
                 executable: str = None,
                 shell: bool = False,
-                expected_return_code: int = 0):
+                expected_return_code: int = 0,
+                capture: bool = False,
+                env: Optional[Dict[str, str]] = None):
         args_list = args
         return self._run(args_list, title, cwd, exception,
                          executable=executable, shell=shell,
-                         expected_return_code=expected_return_code)
+                         expected_return_code=expected_return_code,
+                         capture=capture, env=env)
 
     def _run(self,
              args_list,
@@ -77,19 +212,52 @@ class Runner:
              exception: Type[BaseException] = None,
              executable: str = None,
              shell: bool = False,
-             expected_return_code: int = 0):
+             expected_return_code: int = 0,
+             capture: bool = False,
+             env: Optional[Dict[str, str]] = None):
+        """Runs the command printing its output as soon as it appears.
+        If `capture` is True, the output is also kept in the returned
+        `CompletedProcess.stdout`. Otherwise `stdout` is None."""
 
         print_command(cmd=args_list, at=self.at, title=title)
 
-        cp = run_process(args_list, cwd=cwd, encoding=sys.stdout.encoding,
-                         stdout=PIPE, stderr=STDOUT,
-                         executable=executable,
-                         shell=shell,
-                         universal_newlines=True)
-
-        output = cp.stdout.rstrip()
-        if output:
-            print(output)
+        # when the output is not needed and our stdout is the real one, the
+        # child writes to it directly instead of through a pipe and us.
+        # A replaced sys.stdout (like a test capturing the output) still
+        # gets everything
+        inherit = not capture and sys.stdout is not None \
+            and sys.stdout is sys.__stdout__
+
+        # on POSIX, close_fds=False lets subprocess use posix_spawn instead
+        # of fork+exec, and saves closing every descriptor in the child. It
+        # is safe there: the descriptors Python opens are not inheritable.
+        # On Windows, Popen makes the child's pipe handles inheritable, and
+        # without close_fds the processes started at the same time by other
+        # threads would inherit them and keep the pipes open.
+        # No stdin: the commands must never wait for input
+        with Popen(args_list, cwd=cwd, encoding=STDOUT_ENCODING,
+                   stdin=DEVNULL, stdout=None if inherit else PIPE,
+                   stderr=STDOUT,
+                   close_fds=(os.name == 'nt'),
+                   executable=executable,
+                   shell=shell,
+                   env=env if env is not None else self.env,
+                   universal_newlines=True,
+                   bufsize=1) as process:
+            lines: List[str] = []
+            if process.stdout is not None:
+                _enlarge_pipe(process.stdout.fileno())
+                for line in process.stdout:
+                    write_stdout(line)
+                    if capture:
+                        lines.append(line)
+                # the lines are flushed by the line buffering of a terminal,
+                # but not of a file
+                write_stdout('', flush=True)
+            returncode = process.wait()
+
+        cp = CompletedProcess(args_list, returncode,
+                              stdout=''.join(lines) if capture else None)
 
         if cp.returncode != expected_return_code:
             if exception is None:
@@ -124,46 +292,150 @@ class Package:
     in the test environment, checking that the packages were
     installed correctly."""
 
-    def __init__(self, project_dir: Union[str, Path] = '.'):
+    def __init__(self, project_dir: Union[str, Path] = '.',
+                 skip_twine: bool = False,
+                 tmpfs_dir: Optional[Union[str, Path]] = None,
+                 light_installer: bool = False,
+                 prefetch_deps: bool = False,
+                 reuse_installer: bool = False,
+                 install_deps: bool = True,
+                 no_build_isolation: bool = False,
+                 builder_python: Optional[Union[str, Path]] = None,
+                 cache_wheel: bool = False):
         # we will call __exit__ for each of the following objects
         self._exit_on_cleanup: List[Any] = list()
 
+        self.skip_twine = skip_twine \
+            or os.environ.get('CHKPKG_SKIP_TWINE') == '1'
+
+        # where to create the temporary venv and directories. By default,
+        # in RAM if possible
+        self.tmpfs_dir: Optional[str] = os.fspath(tmpfs_dir) \
+            if tmpfs_dir is not None else ram_temp_dir()
+
         self._installer: Optional[Runner] = None
         self.project_source_dir = Path(project_dir).absolute()
+        # subprocess would convert the Path to str on every call anyway
+        self.project_source_dir_str = os.fspath(self.project_source_dir)
         self.installer_venv: Optional[TempVenv] = None
 
+        # instead of the installer venv, install the package with
+        # 'pip --target' into a directory and run the code by the current
+        # interpreter with PYTHONPATH set to that directory
+        self.light_installer = light_installer
+        self._light_target: Optional[TemporaryDirectory] = None
+
+        # download the dependencies of the wheel by the builder venv while
+        # the installer venv is being prepared, then install them offline
+        self.prefetch_deps = prefetch_deps
+
+        # use the same installer venv for all the Package objects in this
+        # process. The new wheel replaces the previous with --force-reinstall
+        self.reuse_installer = reuse_installer
+
+        # with False, only the wheel itself is installed. This narrows the
+        # check to "does the wheel unpack and import" without pip resolving
+        # and downloading the dependencies
+        self.install_deps = install_deps
+
+        # build the wheel right in the builder venv instead of a new
+        # isolated env with the build requirements downloaded each time.
+        # Only for the projects built by setuptools
+        self.no_build_isolation = no_build_isolation
+
+        # the interpreter that already has build and twine. If set, it is
+        # used as is instead of the cached builder venv
+        self.builder_python: Optional[str] = os.fspath(builder_python) \
+            if builder_python is not None else None
+
+        # keep the wheel that passed the checks in the user cache dir, and
+        # use it instead of building while the source files are the same
+        self.cache_wheel = cache_wheel \
+            or os.environ.get('CHKPKG_CACHE_WHEEL') == '1'
+
+        self._cwd_sandbox: Optional[TemporaryDirectory] = None
+        self._scripts_dir: Optional[TemporaryDirectory] = None
+        self._helpers: List[PythonHelper] = []
+        # the results of find_pytyped for the current installation
+        self._pytyped: Dict[str, Tuple[Path, bool]] = dict()
+        self._build_cleaner: Optional[BuildCleaner] = None
+
     def __enter__(self):
         self.init()
         return self
 
-    def init(self):
-        builder_venv = TempVenv()
-        self._exit_on_cleanup.append(builder_venv)
-        builder_python_exe: str = builder_venv.__enter__()
-        builder_runner = Runner(builder_python_exe, at='builder venv')
-
-        # INSTALLING BUILD ####################################################
+    @staticmethod
+    def _setup_builder_venv(python_exe: str,
+                            requirements=BUILDER_REQUIREMENTS):
+        # one pip call instead of three: we start the interpreter and
+        # resolve the dependencies only once
+        Runner(python_exe, at='builder venv', env=pip_env()).python(
+            ['-m', 'pip', 'install', '--disable-pip-version-check',
+             '--prefer-binary', *pip_cache_args(),
+             '--upgrade', *requirements],
+            title='Installing build and twine',
+            exception=CannotInitializeEnvironment)
 
-        builder_runner.python('-m pip install --upgrade pip',
-                              title='Upgrading pip',
-                              exception=CannotInitializeEnvironment)
-        builder_runner.python('-m pip install --upgrade build',
-                              title='Installing build',
-                              exception=CannotInitializeEnvironment)
+    def init(self):
+        # the installer venv does not depend on the builder venv and the
+        # build, so we create it in parallel from the very beginning. Both
+        # threads mostly wait for subprocesses
+        with TemporaryDirectory(dir=self.tmpfs_dir) as temp_dist_dir, \
+                ThreadPoolExecutor(max_workers=3) as executor:
+            installer_future = executor.submit(self._init_installer_venv)
+
+            # INSTALLING BUILD ################################################
+
+            if self.builder_python is not None:
+                builder_runner = Runner(self.builder_python, at='builder',
+                                        env=pip_env())
+            else:
+                # the builder venv is the same for each run, so it is kept
+                # in the user cache dir and set up only once in a while
+                requirements = NO_ISOLATION_REQUIREMENTS \
+                    if self.no_build_isolation else BUILDER_REQUIREMENTS
+                builder_venv = CachedVenv(
+                    'builder', requirements,
+                    setup=lambda exe: self._setup_builder_venv(exe,
+                                                               requirements))
+                builder_runner = Runner(builder_venv.__enter__(),
+                                        at='builder venv', env=pip_env())
 
-        with TemporaryDirectory() as temp_dist_dir:
             # BUILDING ########################################################
 
-            with BuildCleaner(self.project_source_dir):
-                builder_runner.python(
-                    ['-m', 'build', '--outdir', temp_dist_dir, '--wheel'],
-                    title='Building the .whl',
-                    cwd=self.project_source_dir)
-
-            # finding the .whl file we just created
-            newly_built_whl_file: Path = find_latest_wheel(Path(temp_dist_dir))
-            newly_built_whl_file = newly_built_whl_file.absolute()
-            print(f'Latest wheel: {newly_built_whl_file}')
+            wheel_key: Optional[str] = None
+            cached_whl: Optional[str] = None
+            if self.cache_wheel:
+                wheel_key = tree_fingerprint(
+                    self.project_source_dir_str,
+                    # a new chkpkg may build or check differently
+                    extra=[__version__, sys.version,
+                           str(self.no_build_isolation),
+                           str(self.skip_twine), self.builder_python or ''])
+                cached_whl = cached_wheel(wheel_key)
+
+            if cached_whl is not None:
+                newly_built_whl_file = Path(cached_whl)
+                print_line(f'Cached wheel: {newly_built_whl_file}')
+            else:
+                build_args = ['-m', 'build', '--outdir', temp_dist_dir,
+                              '--wheel']
+                if self.no_build_isolation:
+                    build_args.append('--no-isolation')
+                self._build_cleaner = BuildCleaner(self.project_source_dir)
+                with self._build_cleaner:
+                    build_cp = builder_runner.python(
+                        build_args,
+                        title='Building the .whl',
+                        cwd=self.project_source_dir_str,
+                        capture=True)
+
+                # the build tells the name of the wheel. Scanning the dir is
+                # the fallback for the versions of build that do not
+                newly_built_whl_file = Path(
+                    built_wheel(build_cp.stdout, temp_dist_dir)
+                    or find_latest_wheel(temp_dist_dir))
+                print_line(f'Built wheel: {newly_built_whl_file}')
 
             # TWINE CHECK #####################################################
 
@@ -172,38 +444,157 @@ class Package:
             # InvalidDistribution: Invalid distribution metadata.
             # This version of twine supports Metadata-Version 1.0, 1.1, 1.2,
             # 2.0, and 2.1.
-
-            builder_runner.python('-m pip install --upgrade twine',
-                                  title='Installing twine',
-                                  exception=CannotInitializeEnvironment)
-
-            # running twine checks on the new file
-            builder_runner.python(['-m', 'twine', 'check',
-                                   str(newly_built_whl_file),
-                                   '--strict'],
-                                  title='Twine check',
-                                  exception=TwineCheckFailed)
+            #
+            # So we always install the latest twine along with the build.
+
+            # running twine checks on the new file. The check does not affect
+            # the installation, so it runs in parallel with it
+            twine_future = None
+            # the cached wheel has passed the check already
+            if not self.skip_twine and cached_whl is None:
+                twine_future = executor.submit(
+                    builder_runner.python,
+                    ['-m', 'twine', 'check', str(newly_built_whl_file),
+                     '--strict'],
+                    title='Twine check',
+                    exception=TwineCheckFailed)
+
+            deps_dir = os.path.join(temp_dist_dir, 'deps')
+            deps_future = self._prefetch_deps(
+                executor, builder_runner, newly_built_whl_file, deps_dir)
 
             # TEST VENV #######################################################
 
-            self.installer_venv = TempVenv()
-            self._exit_on_cleanup.append(self.installer_venv)
-            installer_python_exe: str = self.installer_venv.__enter__()
-            self._installer = Runner(installer_python_exe, at='installer venv')
+            installer_future.result()
+            self._install_wheel(
+                newly_built_whl_file,
+                deps_dir if deps_future is not None and deps_future.result()
+                else None)
+
+            if twine_future is not None:
+                twine_future.result()
+
+            if wheel_key is not None and cached_whl is None:
+                store_wheel(wheel_key, str(newly_built_whl_file))
+
+    def _prefetch_deps(self, executor: ThreadPoolExecutor,
+                       builder_runner: Runner, whl: Path,
+                       deps_dir: str) -> Optional[Future]:
+        """Starts downloading the dependencies if it is needed. The future
+        tells whether they can be installed from `deps_dir`."""
+        if not (self.prefetch_deps and self.install_deps):
+            return None
+        # the wheels must suit the installer interpreter. The builder venv
+        # is created by it, and builder_python may be another version.
+        # Without pip, the download fails and the dependencies are installed
+        # from the index
+        downloader = builder_runner if self.builder_python is None \
+            else Runner(sys.executable, at='current interpreter',
+                        env=pip_env())
+        return executor.submit(self._download_deps, downloader, whl,
+                               deps_dir)
+
+    def _install_wheel(self, whl: Path, deps_dir: Optional[str]) -> None:
+        """Installs the wheel by the installer. The dependencies are taken
+        from `deps_dir`, if it is set."""
+        assert self._installer is not None
+        install_args = ['-m', 'pip', 'install',
+                        '--disable-pip-version-check', *pip_cache_args(),
+                        # the installer is removed soon, so compiling every
+                        # installed module is wasted: the imported ones are
+                        # compiled anyway
+                        '--no-compile']
+        if self.reuse_installer:
+            # a fresh venv has nothing to reinstall. The shared one may
+            # have the same version of the package from a previous run
+            install_args.append('--force-reinstall')
+        if not self.install_deps:
+            # with no dependencies, pip needs nothing but the local
+            # wheel, so it does not contact the index at all
+            install_args += ['--no-deps', '--no-index']
+        if deps_dir is not None:
+            install_args += ['--no-index', '--find-links', deps_dir]
+        if self._light_target is not None:
+            # by the pip of the interpreter that will run the code, so the
+            # console scripts get its path in the shebang
+            install_args += ['--target', self._light_target.name]
+
+        self._installer.python(install_args + [str(whl)],
+                               title=f'Installing {whl.name}',
+                               exception=FailedToInstallPackage,
+                               env=pip_env(self._installer.env))
+        # a reused installer may have had other files
+        self._pytyped.clear()
 
-            self._installer.python('-m pip install --upgrade pip',
-                                   title='Upgrading pip',
-                                   exception=CannotInitializeEnvironment)
+    @staticmethod
+    def _download_deps(runner: Runner, whl: Path, dest: str) -> bool:
+        """Downloads the wheel dependencies to `dest`. Returns False if
+        some of them cannot be installed offline from there."""
+        try:
+            # only wheels: an sdist would need build requirements from the
+            # index to be installed
+            runner.python(['-m', 'pip', 'download',
+                           '--disable-pip-version-check',
+                           *pip_cache_args(),
+                           '--only-binary', ':all:',
+                           '--dest', dest, str(whl)],
+                          title='Downloading dependencies')
+            return True
+        except CompletedProcessError:
+            print_line("Cannot prefetch the dependencies, "
+                       "they will be installed from the index")
+            return False
+
+    def _init_light_installer(self):
+        self._light_target = TemporaryDirectory(prefix='chkpkg_target_',
+                                                dir=self.tmpfs_dir)
+        self._exit_on_cleanup.append(self._light_target)
+        target = self._light_target.name
+        # pip install --target puts the scripts to "bin" on every platform
+        scripts = os.path.join(target, 'bin')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            p for p in (target, env.get('PYTHONPATH')) if p)
+        env['PATH'] = os.pathsep.join(
+            p for p in (scripts, env.get('PATH')) if p)
+        self._installer = Runner(sys.executable, at='installer dir', env=env)
+
+    def _init_installer_venv(self):
+        if self.light_installer:
+            self._init_light_installer()
+            return
+
+        if self.reuse_installer:
+            # not added to _exit_on_cleanup: the venv lives until the
+            # process exits
+            self.installer_venv, created = shared_temp_venv(
+                self.tmpfs_dir, template=installer_template())
+            installer_python_exe = self.installer_venv.executable
+            self._installer = Runner(installer_python_exe,
+                                     at='installer venv')
+            if not created:
+                print_line(
+                    f"Reusing venv in {self.installer_venv.venv_dir_str}")
+                return
+        else:
+            self.installer_venv = TempVenv(dir=self.tmpfs_dir,
+                                           template=installer_template())
+            self._exit_on_cleanup.append(self.installer_venv)
+            installer_python_exe = self.installer_venv.__enter__()
+            self._installer = Runner(installer_python_exe,
+                                     at='installer venv')
 
-            self._installer.python(
-                ['-m', 'pip', 'install', '--force-reinstall',
-                 str(newly_built_whl_file)],
-                title=f'Installing {newly_built_whl_file.name}',
-                exception=FailedToInstallPackage)
+        if self.installer_venv.template is None:
+            # a copy of the template already has a recent pip
+            _ensure_recent_pip(self._installer)
 
     def cleanup(self, exc_type=None, exc_val=None, exc_tb=None):
         for x in reversed(self._exit_on_cleanup):
             x.__exit__(exc_type, exc_val, exc_tb)
+        # the build dirs were being removed in the background while the
+        # package was checked. By now it is most likely finished
+        if self._build_cleaner is not None:
+            self._build_cleaner.wait()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.cleanup(exc_type, exc_val, exc_tb)
@@ -215,71 +606,226 @@ class Package:
             o = o.rstrip()
         return o
 
-    def run_python_code(self, code: str, rstrip: bool = True) -> str:
+    def _empty_cwd(self) -> str:
+        """Returns an empty temporary directory to run the code in.
+
+        The same directory is reused by all the calls: we just remove
+        whatever the previous call left there."""
+        if self._cwd_sandbox is None:
+            self._cwd_sandbox = TemporaryDirectory(prefix='chkpkg_cwd_',
+                                                   dir=self.tmpfs_dir)
+            self._exit_on_cleanup.append(self._cwd_sandbox)
+        else:
+            with os.scandir(self._cwd_sandbox.name) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        rmtree(entry.path)
+                    else:
+                        os.unlink(entry.path)
+        return self._cwd_sandbox.name
+
+    def _cached_script_module(self, code: str) -> str:
+        """Saves the code as a module in a temporary directory and returns
+        the module name. The same code is saved only once."""
+        if self._scripts_dir is None:
+            self._scripts_dir = TemporaryDirectory(prefix='chkpkg_scripts_',
+                                                   dir=self.tmpfs_dir)
+            self._exit_on_cleanup.append(self._scripts_dir)
+        digest = hashlib.sha256(code.encode('utf-8')).hexdigest()[:16]
+        module = f'_chkpkg_{digest}'
+        path = os.path.join(self._scripts_dir.name, module + '.py')
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(code)
+        return module
+
+    def run_python_code(self, code: str, rstrip: bool = True,
+                        compile_once: bool = False,
+                        reuse_interpreter: bool = False) -> str:
+        """Runs the code in the installer venv and returns its output.
+
+        With `compile_once`, the code is saved to a module and run as
+        `python -m`, so the repeated runs of the same code use the cached
+        bytecode instead of compiling it again.
+
+        With `reuse_interpreter`, the code is executed by a long-lived
+        interpreter shared by such calls, so it does not pay for the
+        interpreter startup. Only the text printed to `sys.stdout` and
+        `sys.stderr` is returned, and the modules imported by the previous
+        calls stay imported."""
         assert self._installer is not None
-        with TemporaryDirectory() as temp_current_dir:
-            cp = self._installer.python(
-                ['-c', code],
-                title="Running Python code (cwd is temp dir)",
-                cwd=temp_current_dir,
-                exception=CodeExecutionFailed)
-            return self._output(cp, rstrip)
+        if reuse_interpreter:
+            return self._run_in_helper(code, rstrip)
+        args = ['-c', code]
+        env: Optional[Dict[str, str]] = None
+        if compile_once:
+            module = self._cached_script_module(code)
+            assert self._scripts_dir is not None
+            args = ['-m', module]
+            env = dict(self._installer.env or os.environ)
+            env['PYTHONPATH'] = os.pathsep.join(
+                p for p in (self._scripts_dir.name, env.get('PYTHONPATH'))
+                if p)
+        cp = self._installer.python(
+            args,
+            title="Running Python code (cwd is temp dir)",
+            cwd=self._empty_cwd(),
+            exception=CodeExecutionFailed,
+            capture=True,
+            env=env)
+        return self._output(cp, rstrip)
+
+    def run_python_batch(self, codes: Sequence[str],
+                         rstrip: bool = True) -> List[str]:
+        """Runs the codes one after another by a single new interpreter and
+        returns their outputs. Each code gets a fresh namespace, but the
+        modules imported by the previous codes stay imported. If any of the
+        codes fails, CodeExecutionFailed is raised."""
+        codes = list(codes)
+        if not codes:
+            return []
+        separator = f'<<chkpkg<<{uuid.uuid4().hex}>>chkpkg>>'
+        batch = '\n'.join(
+            ['import sys']
+            + [f"print({separator!r}, flush=True); "
+               f"exec(compile({code!r}, '<string>', 'exec'), "
+               f"{{'__name__': '__main__'}}); "
+               f"sys.stdout.flush(); sys.stderr.flush()"
+               for code in codes])
+        output = self.run_python_code(batch, rstrip=False)
+        # the first item is empty: the batch starts with a separator
+        parts = output.split(separator + '\n')[1:]
+        if len(parts) != len(codes):
+            # a code exited with status 0, and the rest were not run
+            raise CodeExecutionFailed(
+                f"Only {len(parts)} of {len(codes)} codes were run: "
+                f"code {len(parts)} exited the interpreter")
+        return [part.rstrip() if rstrip else part for part in parts]
+
+    def _get_helpers(self, count: int) -> List[PythonHelper]:
+        """Returns `count` helper interpreters, starting the missing ones.
+        They run in the empty cwd, which is cleared by this call."""
+        assert self._installer is not None
+        cwd = self._empty_cwd()
+        while len(self._helpers) < count:
+            helper = PythonHelper(self._installer.python_exe, cwd=cwd,
+                                  env=self._installer.env)
+            self._helpers.append(helper)
+            self._exit_on_cleanup.append(helper)
+        return self._helpers[:count]
+
+    def _helper_output(self, code: str, status: int, output: str,
+                       rstrip: bool) -> str:
+        assert self._installer is not None
+        print_command(code, title="Running Python code (reused interpreter)",
+                      at=self._installer.at)
+        write_stdout(output)
+        cp = CompletedProcess(['-c', code], status, stdout=output)
+        if status != 0:
+            raise CodeExecutionFailed(process=cp)
+        return self._output(cp, rstrip)
+
+    def _run_in_helper(self, code: str, rstrip: bool) -> str:
+        helper = self._get_helpers(1)[0]
+        status, output = helper.run(code)
+        return self._helper_output(code, status, output, rstrip)
+
+    def run_python_code_many(self, codes: Sequence[str],
+                             rstrip: bool = True,
+                             workers: int = 4) -> List[str]:
+        """Runs each of the codes as `run_python_code(code,
+        reuse_interpreter=True)` would, but up to `workers` of them at the
+        same time, each by its own interpreter. Returns the outputs in the
+        order of `codes`.
+
+        The codes run in the same cwd, so they should not write files
+        there."""
+        codes = list(codes)
+        if not codes:
+            return []
+        idle: Queue = Queue()
+        for helper in self._get_helpers(max(1, min(workers, len(codes)))):
+            idle.put(helper)
+
+        def run_one(code: str) -> Tuple[int, str]:
+            helper = idle.get()
+            try:
+                return helper.run(code)
+            finally:
+                idle.put(helper)
+
+        with ThreadPoolExecutor(max_workers=idle.qsize()) as executor:
+            results = list(executor.map(run_one, codes))
+
+        # printed afterwards, so the outputs do not interleave
+        return [self._helper_output(code, status, output, rstrip)
+                for code, (status, output) in zip(codes, results)]
 
     @property
     def _can_run_bash(self):
         return os.path.exists("/bin/bash")
 
+    def _activated_env(self) -> Optional[Dict[str, str]]:
+        """The environment the activate script would set up. Setting it
+        directly saves interpreting the script on each call."""
+        assert self._installer is not None
+        if self.installer_venv is None:
+            # the light installer env already has the scripts on PATH
+            return self._installer.env
+        venv_dir = self.installer_venv.venv_dir_str
+        scripts = os.path.join(venv_dir,
+                               'Scripts' if os.name == 'nt' else 'bin')
+        env = dict(self._installer.env or os.environ)
+        env['PATH'] = os.pathsep.join(
+            p for p in (scripts, env.get('PATH')) if p)
+        env['VIRTUAL_ENV'] = venv_dir
+        env.pop('PYTHONHOME', None)
+        return env
+
     def _run_bash_code(self, code: str, rstrip: bool = True,
                        expected_return_code: int = 0):
 
-        with TemporaryDirectory() as temp_cwd:
-            assert self.installer_venv is not None
-            activate = self.installer_venv.paths.posix_bash_activate
-            code = '\n'.join(["#!/bin/bash",
-                              "set -e",
-                              f'source "{activate}"',
-                              code])
-
-            # we need executable='/bin/bash' for Ubuntu 18.04, it will run
-            # '/bin/sh' otherwise. For MacOS 10.13 it seems to be optional
-            assert self._installer is not None
-            cp = self._installer.command(
-                code,
-                title="Running Bash code (cwd is temp dir)",
-                cwd=temp_cwd,
-                executable='/bin/bash',
-                shell=True,
-                exception=CodeExecutionFailed,
-                expected_return_code=expected_return_code
-            )
-
-            return self._output(cp, rstrip)
+        code = '\n'.join(["set -e", code])
+
+        # running /bin/bash explicitly: Ubuntu 18.04 would run '/bin/sh'
+        # for shell=True
+        assert self._installer is not None
+        cp = self._installer.command(
+            ['/bin/bash', '-c', code],
+            title="Running Bash code (cwd is temp dir)",
+            cwd=self._empty_cwd(),
+            shell=False,
+            exception=CodeExecutionFailed,
+            capture=True,
+            expected_return_code=expected_return_code,
+            env=self._activated_env()
+        )
+
+        return self._output(cp, rstrip)
 
     def _run_cmdexe_code(self, code: str,
                          rstrip: bool = True,
                          expected_return_code: int = 0):
         """Runs command in cmd.exe"""
-        with TemporaryDirectory() as temp_cwd:
-            assert self.installer_venv is not None
-            activate_bat = self.installer_venv.paths.windows_cmdexe_activate
-
-            # temp file with commands to run
-            temp_bat_file = Path(temp_cwd) / "_run_cmdexe_code.bat"
-            temp_bat_file.write_text(
-                '\n'.join([f"CALL {activate_bat}",
-                           code]))
-
-            # todo param /u formats output as unicode?
-            assert self._installer is not None
-            cp = self._installer.command(
-                ["cmd.exe", "/q", "/c", str(temp_bat_file)],
-                title="Running code in cmd.exe (cwd is temp dir)",
-                cwd=temp_cwd,
-                shell=False,
-                exception=CodeExecutionFailed,
-                expected_return_code=expected_return_code)
-
-            return self._output(cp, rstrip)
+        temp_cwd = self._empty_cwd()
+
+        # temp file with commands to run
+        temp_bat_file = Path(temp_cwd) / "_run_cmdexe_code.bat"
+        temp_bat_file.write_text(code)
+
+        # todo param /u formats output as unicode?
+        assert self._installer is not None
+        cp = self._installer.command(
+            ["cmd.exe", "/q", "/c", str(temp_bat_file)],
+            title="Running code in cmd.exe (cwd is temp dir)",
+            cwd=temp_cwd,
+            shell=False,
+            exception=CodeExecutionFailed,
+            capture=True,
+            expected_return_code=expected_return_code,
+            env=self._activated_env())
+
+        return self._output(cp, rstrip)
 
     def run_shell_code(self, code: str, rstrip: bool = True,
                        expected_return_code: int = 0) -> str:
@@ -292,5 +838,12 @@ class Package:
 
     def require_pytyped(self, module: str):
         assert self._installer is not None
-        path = get_module_path(self._installer.python_exe, module)
-        require_dir_contains_pytyped(path.parent)
+        found = self._pytyped.get(module)
+        if found is None:
+            found = self._pytyped[module] = find_pytyped(
+                self._installer.python_exe, module, env=self._installer.env,
+                cwd=self._empty_cwd())
+        pytyped, exists = found
+        if not exists:
+            raise PytypedNotFound(f'File "{pytyped}" not found')
+        print_line(f"'{pytyped}' exists")
@@ -1,40 +1,94 @@
 # SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
 # SPDX-License-Identifier: MIT
 
-import re
+import json
+import os
 import subprocess
-import sys
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import Optional, Dict, Union, Tuple
 
+from chkpkg._encoding import STDOUT_ENCODING
 from chkpkg._exceptions import PytypedNotFound
 
 
-def get_module_path(python_exe: str, module_name: str) -> Path:
+def get_module_path(python_exe: str, module_name: str,
+                    env: Optional[Dict[str, str]] = None,
+                    cwd: Optional[Union[str, Path]] = None) -> Path:
+    """Returns the file the module is imported from. The module is located
+    from an empty `cwd`, so it is not found in a local dir. If `cwd` is not
+    specified, a temporary empty dir is created."""
     prefix = '<<chkpkg<<'
     suffix = '>>chkpkg>>'
 
+    # find_spec locates the module without executing it. For a dotted name
+    # only the parent packages are imported
     pycode = \
-        f"import sys\n" \
-        f"import {module_name}\n" \
-        f"print('{prefix}'+sys.modules['{module_name}'].__file__+'{suffix}')\n"
-
-    with TemporaryDirectory() as temp_empty_dir:
-        # decoding may fail on windows?
-        output = subprocess.check_output(
-            [python_exe, '-c', pycode],
-            encoding=sys.stdout.encoding,
-            # empty temp dir makes python to use the module from packages dir,
-            # not from any local dir
-            cwd=temp_empty_dir)
-
-    m = re.search(re.escape(prefix) + "(.*)" + re.escape(suffix), output)
-    assert m is not None
-    filename = m.group(1).strip()
+        f"import importlib.util, sys\n" \
+        f"spec = importlib.util.find_spec('{module_name}')\n" \
+        f"if spec is None or not spec.has_location:\n" \
+        f"    sys.exit('No file for module {module_name}')\n" \
+        f"print('{prefix}'+spec.origin+'{suffix}')\n"
+
+    if cwd is None:
+        with TemporaryDirectory() as temp_empty_dir:
+            return get_module_path(python_exe, module_name, env=env,
+                                   cwd=temp_empty_dir)
+
+    # decoding may fail on windows?
+    output = subprocess.check_output(
+        [python_exe, '-c', pycode],
+        encoding=STDOUT_ENCODING,
+        # empty dir makes python to use the module from packages dir,
+        # not from any local dir
+        cwd=cwd,
+        env=env,
+        close_fds=(os.name == 'nt'))
+
+    _, found, tail = output.partition(prefix)
+    assert found
+    filename = tail.partition(suffix)[0].strip()
 
     return Path(filename)
 
 
+def find_pytyped(python_exe: str, module_name: str,
+                 env: Optional[Dict[str, str]] = None,
+                 cwd: Optional[Union[str, Path]] = None) -> Tuple[Path, bool]:
+    """Returns the path of the `py.typed` file next to the module, and
+    whether the file exists. Unlike `get_module_path` followed by
+    `require_dir_contains_pytyped`, the file is checked by the same
+    subprocess that locates the module."""
+    prefix = '<<chkpkg<<'
+
+    # the parent packages imported by find_spec may print something, so
+    # the result line is marked
+    pycode = \
+        f"import importlib.util, json, os, sys\n" \
+        f"spec = importlib.util.find_spec('{module_name}')\n" \
+        f"if spec is None or not spec.has_location:\n" \
+        f"    sys.exit('No file for module {module_name}')\n" \
+        f"p = os.path.join(os.path.dirname(spec.origin), 'py.typed')\n" \
+        f"print('{prefix}'+json.dumps([p, os.path.isfile(p)]))\n"
+
+    if cwd is None:
+        with TemporaryDirectory() as temp_empty_dir:
+            return find_pytyped(python_exe, module_name, env=env,
+                                cwd=temp_empty_dir)
+
+    output = subprocess.check_output(
+        [python_exe, '-c', pycode],
+        encoding=STDOUT_ENCODING,
+        cwd=cwd,
+        env=env,
+        close_fds=(os.name == 'nt'))
+
+    _, found, tail = output.partition(prefix)
+    assert found
+    path, exists = json.loads(tail.partition('\n')[0])
+    return Path(path), exists
+
+
 def require_dir_contains_pytyped(parent: Path) -> None:
     parent = parent.absolute()
     if not parent.exists():
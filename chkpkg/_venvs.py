@@ -1,11 +1,24 @@
 # SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
 # SPDX-License-Identifier: MIT
 
+import atexit
+import hashlib
+import importlib.util
+import inspect
+import json
 import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
 import venv
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Union, Optional
+from typing import Union, Optional, Dict, Any, Sequence, Callable, Tuple
+
+from ._cache import user_cache_dir, file_lock
+from ._output import print_line
 
 
 class VenvPaths:
@@ -21,8 +34,11 @@ class VenvPaths:
 
     @property
     def executable(self):
-        return self._find(self.venv_dir / 'bin' / 'python',
-                          self.venv_dir / 'Scripts' / 'python.exe')
+        # the layout depends only on the platform, so we do not probe
+        # the path that cannot exist
+        if os.name == 'nt':
+            return self._find(self.venv_dir / 'Scripts' / 'python.exe')
+        return self._find(self.venv_dir / 'bin' / 'python')
 
     @property
     def windows_cmdexe_activate(self):
@@ -35,6 +51,91 @@ class VenvPaths:
         return self._find(self.venv_dir / 'bin' / 'activate')
 
 
+def _new_env_builder() -> venv.EnvBuilder:
+    kwargs: Dict[str, Any] = dict(
+        with_pip=True, clear=True,
+        # symlinking the interpreter is cheaper than copying it,
+        # but on Windows symlinks may require extra privileges
+        symlinks=(os.name != 'nt'))
+    if 'scm_ignore_files' in inspect.signature(venv.EnvBuilder).parameters:
+        # Python 3.13+ writes .gitignore into the venv by default. Nobody
+        # needs it in a temp dir
+        kwargs['scm_ignore_files'] = frozenset()
+    return venv.EnvBuilder(**kwargs)
+
+
+_env_builder = _new_env_builder()
+
+
+def _create_venv(venv_dir: str) -> None:
+    # virtualenv seeds pip from its app-data cache, which takes a fraction
+    # of the time of ensurepip. We use it if it is installed
+    if importlib.util.find_spec('virtualenv') is not None:
+        subprocess.check_call([sys.executable, '-m', 'virtualenv',
+                               '--quiet', '--clear', venv_dir],
+                              close_fds=(os.name == 'nt'))
+    else:
+        _env_builder.create(venv_dir)
+
+
+def _clone_venv(src: str, dst: str) -> None:
+    """Copies the venv from `src` into the existing empty `dst` directory
+    and rewrites the absolute paths that refer to `src`.
+
+    A venv is not relocatable in general, but the few places where its own
+    path is written are known: the shebangs of the scripts, the activate
+    scripts and `pyvenv.cfg`. The files are copied with the symlinks kept,
+    so the interpreter still points to the base Python."""
+    with os.scandir(src) as it:
+        for entry in it:
+            if entry.name == _READY_FILE:
+                continue
+            target = os.path.join(dst, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                shutil.copytree(entry.path, target, symlinks=True)
+            else:
+                shutil.copy2(entry.path, target, follow_symlinks=False)
+
+    old = os.fsencode(src)
+    new = os.fsencode(dst)
+    fixups = [os.path.join(dst, 'pyvenv.cfg')]
+    with os.scandir(os.path.join(dst, 'bin')) as it:
+        fixups.extend(e.path for e in it if e.is_file(follow_symlinks=False))
+    for path in fixups:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            continue
+        if old in data:
+            with open(path, 'wb') as f:
+                f.write(data.replace(old, new))
+
+
+def ram_temp_dir(min_free: int = 1 << 30) -> Optional[str]:
+    """Returns `/dev/shm` if it is a writable RAM-backed directory with at
+    least `min_free` bytes available. Otherwise returns None, meaning the
+    default temp dir.
+
+    Venvs consist of thousands of small files, so creating them in RAM
+    is noticeably faster than on disk."""
+    if not sys.platform.startswith('linux'):
+        return None
+    shm = '/dev/shm'
+    try:
+        if not (os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK)):
+            return None
+        st = os.statvfs(shm)
+    except OSError:
+        return None
+    if st.f_flag & os.ST_NOEXEC:
+        # console scripts installed into a venv there could not be run
+        return None
+    if st.f_bavail * st.f_frsize < min_free:
+        return None
+    return shm
+
+
 class TempVenv:
     """Creates virtual environment in a temporary directory.
     Removes the directory and the environment when `cleanup` is called.
@@ -42,11 +143,23 @@ class TempVenv:
 
     with TempVenv() as python_exe:
         run([python_exe, '-m', 'module'])
+
+    The temporary directory is created inside `dir`, if specified.
+    Otherwise, in RAM if possible (see `ram_temp_dir`), or in the default
+    temp dir.
+
+    If `template` is specified, the venv is a copy of the template instead
+    of a freshly created one. Copying is an order of magnitude faster than
+    bootstrapping pip. It is only done on POSIX: on Windows the script
+    launchers are executables with the paths embedded.
     """
 
-    def __init__(self):
+    def __init__(self, dir: Optional[str] = None,
+                 template: Optional['CachedVenv'] = None):
+        self.dir = dir if dir is not None else ram_temp_dir()
+        self.template = template if os.name != 'nt' else None
         self._temp_dir: Optional[TemporaryDirectory] = None
-        self._executable = None
+        self._executable: Optional[str] = None
 
     @property
     def venv_dir_str(self) -> str:
@@ -61,19 +174,143 @@ class TempVenv:
         return VenvPaths(self._temp_dir.name)
 
     def create(self):
-        self._temp_dir = TemporaryDirectory()
+        self._temp_dir = TemporaryDirectory(dir=self.dir)
+        self._executable = None
         assert os.path.exists(self.venv_dir_str)
         assert os.path.isdir(self.venv_dir_str)
-        print(f"Initializing venv in {self.venv_dir_str}")
-        venv.create(env_dir=self.venv_dir_str, with_pip=True, clear=True)
+        if self.template is not None:
+            self.template.clone_to(self.venv_dir_str)
+            return
+        print_line(f"Initializing venv in {self.venv_dir_str}")
+        _create_venv(self.venv_dir_str)
 
     def cleanup(self):
-        print(f"Removing temp venv dir {self._temp_dir.name}")
+        print_line(f"Removing temp venv dir {self._temp_dir.name}")
         self._temp_dir.cleanup()
 
+    @property
+    def executable(self) -> str:
+        # the path is found once: it does not change while the venv exists
+        if self._executable is None:
+            self._executable = str(self.paths.executable)
+        return self._executable
+
     def __enter__(self) -> str:
         self.create()
-        return str(self.paths.executable)
+        return self.executable
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.cleanup()
+
+
+_shared_venv: Optional[TempVenv] = None
+_shared_venv_lock = threading.Lock()
+
+
+def shared_temp_venv(dir: Optional[str] = None,
+                     template: Optional['CachedVenv'] = None) \
+        -> Tuple[TempVenv, bool]:
+    """Returns a temporary venv that is shared by all the callers in this
+    process. It is created by the first call and removed when the process
+    exits. The second item of the returned tuple is True if the venv was
+    just created."""
+    global _shared_venv
+    with _shared_venv_lock:
+        if _shared_venv is not None:
+            return _shared_venv, False
+        shared = TempVenv(dir=dir, template=template)
+        shared.__enter__()
+        atexit.register(shared.cleanup)
+        _shared_venv = shared
+        return shared, True
+
+
+_READY_FILE = 'chkpkg_ready.json'
+
+
+class CachedVenv:
+    """Virtual environment that persists in the user cache directory
+    and is reused by the following runs.
+
+    The environment is identified by the base interpreter and the
+    `requirements`. On the first run (or when the environment is older
+    than `max_age` seconds) it is created from scratch and `setup(python_exe)`
+    is called to install the requirements. Otherwise the existing environment
+    is returned as is.
+
+    with CachedVenv('builder', ['build'], setup) as python_exe:
+        run([python_exe, '-m', 'build'])
+    """
+
+    def __init__(self, role: str,
+                 requirements: Sequence[str],
+                 setup: Callable[[str], None],
+                 max_age: float = 24 * 60 * 60):
+        self.requirements = tuple(requirements)
+        self.setup = setup
+        self.max_age = max_age
+
+        key = hashlib.sha256(json.dumps([
+            sys.version,
+            sys.executable,
+            os.stat(sys.executable).st_mtime,
+            self.requirements,
+        ]).encode('utf-8')).hexdigest()[:16]
+        py_ver = '%d.%d' % sys.version_info[:2]
+        self.venv_dir_str = str(
+            user_cache_dir() / f"{role}-{py_ver}-{key}")
+
+    @property
+    def paths(self) -> VenvPaths:
+        return VenvPaths(self.venv_dir_str)
+
+    @property
+    def _ready_file(self) -> str:
+        return os.path.join(self.venv_dir_str, _READY_FILE)
+
+    def _is_ready(self) -> bool:
+        try:
+            with open(self._ready_file, encoding='utf-8') as f:
+                created = json.load(f)['created']
+        except (OSError, ValueError, KeyError):
+            return False
+        return time.time() - created < self.max_age
+
+    def _lock(self):
+        return file_lock(Path(self.venv_dir_str + '.lock'))
+
+    def _ensure_ready(self):
+        # to be called with the lock held
+        if self._is_ready():
+            print_line(f"Reusing cached venv in {self.venv_dir_str}")
+            return
+        print_line(f"Initializing cached venv in {self.venv_dir_str}")
+        _create_venv(self.venv_dir_str)
+        self.setup(str(self.paths.executable))
+        # written only after the setup succeeded, so an interrupted setup
+        # is repeated next time
+        with open(self._ready_file, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.time(),
+                       'requirements': self.requirements}, f)
+
+    def create(self):
+        with self._lock():
+            self._ensure_ready()
+
+    def clone_to(self, dst: str):
+        """Creates the environment if needed and copies it into the empty
+        `dst` directory."""
+        with self._lock():
+            # the lock also keeps another process from rebuilding the venv
+            # while we copy it
+            self._ensure_ready()
+            print_line(f"Copying cached venv to {dst}")
+            _clone_venv(self.venv_dir_str, dst)
+
+    def __enter__(self) -> str:
+        self.create()
+        return str(self.paths.executable)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the environment is kept for the next run
+        pass
@@ -0,0 +1,69 @@
+# SPDX-FileCopyrightText: (c) 2021 Arteom iG (rtmigo.github.io)
+# SPDX-License-Identifier: MIT
+
+"""Builds and installs the package once, then runs the checks requested
+through stdin. Each request is a JSON line like
+
+    {"op": "run_python", "code": "import mypackage"}
+    {"op": "run_shell", "code": "mypackage_cli", "expected_return_code": 2}
+    {"op": "require_pytyped", "module": "mypackage"}
+
+and gets a JSON line in reply:
+
+    {"ok": true, "output": "..."}
+    {"ok": false, "error": "CodeExecutionFailed", "message": "..."}
+
+The log that chkpkg normally prints goes to stderr.
+
+    python -m chkpkg.serve [project_dir]
+"""
+
+import json
+import os
+import sys
+from typing import Dict, Any, TextIO
+
+from ._package import Package
+
+
+def _handle(pkg: Package, request: Dict[str, Any]) -> Dict[str, Any]:
+    op = request.get('op')
+    if op == 'run_python':
+        return {'output': pkg.run_python_code(
+            request['code'], rstrip=request.get('rstrip', True))}
+    if op == 'run_shell':
+        return {'output': pkg.run_shell_code(
+            request['code'], rstrip=request.get('rstrip', True),
+            expected_return_code=request.get('expected_return_code', 0))}
+    if op == 'require_pytyped':
+        pkg.require_pytyped(request['module'])
+        return {}
+    raise ValueError(f"Unknown op: {op!r}")
+
+
+def serve(project_dir: str, requests: TextIO, replies: TextIO) -> None:
+    with Package(project_dir) as pkg:
+        for line in requests:
+            if not line.strip():
+                continue
+            try:
+                reply = _handle(pkg, json.loads(line))
+                reply['ok'] = True
+            except Exception as e:
+                reply = {'ok': False, 'error': type(e).__name__,
+                         'message': str(e)}
+            replies.write(json.dumps(reply) + '\n')
+            replies.flush()
+
+
+def main():
+    # the replies get the real stdout. Everything else written to fd 1,
+    # including the output of the subprocesses, goes to stderr
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    serve(sys.argv[1] if len(sys.argv) > 1 else '.', sys.stdin, replies)
+
+
+if __name__ == "__main__":
+    main()
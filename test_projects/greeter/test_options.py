@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+
+from chkpkg import Package
+
+
+def check(pkg: Package):
+    _, hi = pkg.run_python_batch(['import greeter',
+                                  'import greeter; greeter.say_hi()'])
+    assert hi == 'hi!'
+    assert pkg.run_shell_code('greeter_cli hi') == 'hi!'
+
+
+def builder_venv(parent: str) -> str:
+    """Creates a venv with build and twine, and returns its interpreter."""
+    subprocess.check_call([sys.executable, '-m', 'venv', parent])
+    python = os.path.join(parent, 'Scripts' if os.name == 'nt' else 'bin',
+                          'python')
+    subprocess.check_call([python, '-m', 'pip', 'install', '--quiet',
+                           'build', 'twine'])
+    return python
+
+
+if __name__ == "__main__":
+    with Package(light_installer=True) as pkg:
+        check(pkg)
+        # the script must be run by the interpreter that runs the code,
+        # not by the one that built the wheel. The code is run by the
+        # current interpreter, and its path is in the script or, on
+        # Windows, in the launcher .exe
+        found = pkg.run_python_code(
+            "import os, shutil, sys\n"
+            "with open(shutil.which('greeter_cli'), 'rb') as f:\n"
+            "    print(os.fsencode(sys.executable) in f.read())")
+        assert found == 'True', found
+
+    # the second one installs over the first
+    for _ in range(2):
+        with Package(reuse_installer=True) as pkg:
+            check(pkg)
+
+    # greeter has no dependencies, so these only have to work
+    for options in [dict(prefetch_deps=True),
+                    dict(install_deps=False),
+                    dict(no_build_isolation=True)]:
+        print(f"Options: {options}")
+        with Package(**options) as pkg:
+            check(pkg)
+
+    with TemporaryDirectory() as td:
+        # the dependencies are downloaded by the current interpreter
+        with Package(builder_python=builder_venv(td),
+                     prefetch_deps=True) as pkg:
+            check(pkg)
+
+    print("\nOptions are OK!")
@@ -2,10 +2,10 @@ from chkpkg import Package
 
 if __name__ == "__main__":
     with Package() as pkg:
-        pkg.run_python_code('import greeter')
-
-        code = 'import greeter; greeter.say_hi()'
-        assert pkg.run_python_code(code) == 'hi!'
+        # one interpreter for both snippets
+        _, hi = pkg.run_python_batch(['import greeter',
+                                      'import greeter; greeter.say_hi()'])
+        assert hi == 'hi!'
 
         outp = pkg.run_shell_code('greeter_cli hi')
         print(f'got output [{outp}]')
@@ -1,7 +1,19 @@
+# Runs the unit tests and the checks of the test projects.
+#
+# The script starts a lot of subprocesses. On POSIX with Python 3.8+,
+# subprocess starts them by posix_spawn, which is cheaper than fork+exec,
+# unless preexec_fn, start_new_session or close_fds=True (the default)
+# are used, or cwd is set. chkpkg passes close_fds=False on POSIX where it
+# can (on Windows the pipe handles of a child are inheritable, so they are
+# closed there), and nothing here should add the other arguments without a
+# reason.
+
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from subprocess import check_call
+from typing import Dict, List, Sequence, Tuple
 
 parent = Path(__file__).parent
 tests = parent / "test_projects"
@@ -17,22 +29,82 @@ def splitter(title: str):
     print()
 
 
+def installed_from_source() -> bool:
+    """Returns True if the chkpkg imported outside the source dir (as the
+    test projects import it) is this source tree. Then the editable install
+    is already done."""
+    cp = subprocess.run(
+        [sys.executable, '-c',
+         'import importlib.util; '
+         'print(importlib.util.find_spec("chkpkg").origin)'],
+        cwd=tests, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        universal_newlines=True)
+    return cp.returncode == 0 and \
+        Path(cp.stdout.strip()).parent.resolve() == \
+        (parent / 'chkpkg').resolve()
+
+
+def run_test_pkg(project: str, scripts: Sequence[str]) \
+        -> List[subprocess.CompletedProcess]:
+    """Runs the scripts of the project one after another."""
+    return [subprocess.run([sys.executable, script],
+                           cwd=tests / project,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                           universal_newlines=True)
+            for script in scripts]
+
+
 if __name__ == "__main__":
-    subprocess.check_call([sys.executable, '-m', 'unittest'])
-    #exit(0)
+    # the unit tests import chkpkg from the source dir, so they do not
+    # need the installation and run while it is going on
+    unit_tests = subprocess.Popen([sys.executable, '-m', 'unittest'],
+                                  cwd=parent,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT,
+                                  universal_newlines=True)
 
     splitter("INSTALLING ITSELF")
-    check_call([sys.executable, '-m', 'pip', 'install', '-e', '.'], cwd=parent)
+    if installed_from_source():
+        print("Already installed from the source dir")
+    else:
+        check_call([sys.executable, '-m', 'pip', 'install', '-e', '.'],
+                   cwd=parent)
+
+    splitter("UNIT TESTS")
+    unit_output, _ = unit_tests.communicate()
+    print(unit_output)
+    if unit_tests.returncode != 0:
+        sys.exit(unit_tests.returncode)
 
-    splitter("TEST 2")
-    check_call([sys.executable, 'test_pkg.py'], cwd=tests / 'greeter')
+    checks = [
+        ("TEST 2", 'greeter', 'test_pkg.py'),
+        ("options", 'greeter', 'test_options.py'),
+        ("TEST 3", 'invalid_metadata', 'test_pkg.py'),
+        ("require pytyped: ok", 'greeter_pytyped_ok', 'test_pkg.py'),
+        ("require pytyped: fail", 'greeter_pytyped_fail', 'test_pkg.py'),
+    ]
 
-    splitter("TEST 3")
-    check_call([sys.executable, 'test_pkg.py'], cwd=tests / 'invalid_metadata')
+    # a check builds its project dir, and two builds of one dir at the
+    # same time break each other. So the checks of a project run one after
+    # another, and the projects run at the same time: their checks mostly
+    # wait for subprocesses. The output is captured and printed in order,
+    # so the logs do not interleave
+    projects: Dict[str, List[Tuple[str, str]]] = dict()
+    for title, project, script in checks:
+        projects.setdefault(project, []).append((title, script))
 
-    splitter("require pytyped: ok")
-    check_call([sys.executable, 'test_pkg.py'],
-               cwd=tests / 'greeter_pytyped_ok')
+    with ThreadPoolExecutor(max_workers=len(projects)) as executor:
+        results = executor.map(
+            run_test_pkg, projects,
+            [[script for _, script in s] for s in projects.values()])
+        failed = []
+        for (project, scripts), cps in zip(projects.items(), results):
+            for (title, script), cp in zip(scripts, cps):
+                splitter(title)
+                print(cp.stdout)
+                if cp.returncode != 0:
+                    failed.append(f'{project}/{script}')
 
-    splitter("require pytyped: fail")
-    check_call([sys.executable, 'test_pkg.py'], cwd=tests / 'greeter_pytyped_fail')
\ No newline at end of file
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,44 @@
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from chkpkg._cache import tree_fingerprint
+
+
+class TestTreeFingerprint(unittest.TestCase):
+    def test_changes(self):
+        with TemporaryDirectory() as td:
+            src = Path(td) / 'pkg' / 'mod.py'
+            src.parent.mkdir()
+            src.write_text('x = 1')
+            os.utime(src, (1000, 1000))
+            first = tree_fingerprint(td)
+            self.assertEqual(tree_fingerprint(td), first)
+
+            # the build output does not matter
+            (Path(td) / 'build').mkdir()
+            (Path(td) / 'build' / 'mod.py').write_text('')
+            (Path(td) / 'pkg.egg-info').mkdir()
+            self.assertEqual(tree_fingerprint(td), first)
+
+            self.assertNotEqual(tree_fingerprint(td, extra=['3.9']), first)
+
+            src.write_text('x = 2')
+            os.utime(src, (1000, 1000))
+            self.assertEqual(tree_fingerprint(td), first)  # same size
+            os.utime(src, (2000, 2000))
+            self.assertNotEqual(tree_fingerprint(td), first)
+
+    def test_nested_build_dir(self):
+        with TemporaryDirectory() as td:
+            (Path(td) / 'pkg' / 'build').mkdir(parents=True)
+            first = tree_fingerprint(td)
+            # a subpackage named "build" is the source
+            (Path(td) / 'pkg' / 'build' / 'mod.py').write_text('')
+            self.assertNotEqual(tree_fingerprint(td), first)
+            second = tree_fingerprint(td)
+            # the caches are skipped at any depth
+            (Path(td) / 'pkg' / '__pycache__').mkdir()
+            (Path(td) / 'pkg' / '__pycache__' / 'mod.pyc').write_text('')
+            self.assertEqual(tree_fingerprint(td), second)
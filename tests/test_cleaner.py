@@ -0,0 +1,69 @@
+import os
+import stat
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from chkpkg._cleaner import BuildCleaner, rmtree
+
+
+class TestBuildCleaner(unittest.TestCase):
+    def test_removes_new_eggs_only(self):
+        with TemporaryDirectory() as td:
+            project = Path(td)
+            old_egg = project / "old.egg-info"
+            old_egg.mkdir()
+
+            with BuildCleaner(project) as cleaner:
+                (project / "new.egg-info").mkdir()
+                (project / "build").mkdir()
+                (project / "build" / "file.txt").write_text("data")
+
+            self.assertTrue(old_egg.exists())
+            self.assertFalse((project / "new.egg-info").exists())
+            self.assertFalse((project / "build").exists())
+
+            cleaner.wait()
+            self.assertEqual([p.name for p in project.iterdir()],
+                             ["old.egg-info"])
+
+    def test_keeps_existing_build_dir(self):
+        with TemporaryDirectory() as td:
+            project = Path(td)
+            (project / "build").mkdir()
+            with BuildCleaner(project):
+                pass
+            self.assertTrue((project / "build").exists())
+
+
+class TestRmtree(unittest.TestCase):
+    def test_removes_tree(self):
+        with TemporaryDirectory() as td:
+            root = Path(td) / "root"
+            (root / "a" / "b").mkdir(parents=True)
+            readonly = root / "a" / "b" / "readonly.txt"
+            readonly.write_text("data")
+            os.chmod(readonly, stat.S_IREAD)
+
+            rmtree(root)
+            self.assertFalse(root.exists())
+
+    def test_does_not_follow_symlinks(self):
+        with TemporaryDirectory() as td:
+            target = Path(td) / "target"
+            target.mkdir()
+            (target / "keep.txt").write_text("data")
+            root = Path(td) / "root"
+            root.mkdir()
+            try:
+                (root / "link").symlink_to(target, target_is_directory=True)
+            except OSError:
+                self.skipTest("cannot create symlinks")
+
+            rmtree(root)
+            self.assertFalse(root.exists())
+            self.assertTrue((target / "keep.txt").exists())
+
+    def test_missing(self):
+        with TemporaryDirectory() as td:
+            rmtree(Path(td) / "missing")  # no errors
@@ -0,0 +1,36 @@
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from chkpkg._venvs import _clone_venv
+
+
+@unittest.skipIf(os.name == 'nt', "venvs are cloned only on POSIX")
+class TestCloneVenv(unittest.TestCase):
+    def test_paths_rewritten(self):
+        with TemporaryDirectory() as src, TemporaryDirectory() as dst:
+            bin_dir = Path(src) / 'bin'
+            bin_dir.mkdir()
+            (bin_dir / 'pip').write_text(f"#!{src}/bin/python\nimport pip\n")
+            (bin_dir / 'activate').write_text(f"VIRTUAL_ENV='{src}'\n")
+            os.symlink('/usr/bin/python3', str(bin_dir / 'python'))
+            (Path(src) / 'pyvenv.cfg').write_text("home = /usr/bin\n")
+            lib = Path(src) / 'lib' / 'site-packages'
+            lib.mkdir(parents=True)
+            (lib / 'mod.py').write_text(f"# {src}\n")
+            (Path(src) / 'chkpkg_ready.json').write_text('{}')
+
+            _clone_venv(src, dst)
+
+            self.assertEqual((Path(dst) / 'bin' / 'pip').read_text(),
+                             f"#!{dst}/bin/python\nimport pip\n")
+            self.assertEqual((Path(dst) / 'bin' / 'activate').read_text(),
+                             f"VIRTUAL_ENV='{dst}'\n")
+            self.assertEqual(os.readlink(str(Path(dst) / 'bin' / 'python')),
+                             '/usr/bin/python3')
+            # only the known places are rewritten
+            self.assertEqual(
+                (Path(dst) / 'lib' / 'site-packages' / 'mod.py').read_text(),
+                f"# {src}\n")
+            self.assertFalse((Path(dst) / 'chkpkg_ready.json').exists())
@@ -0,0 +1,42 @@
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from chkpkg._package import find_latest_wheel, built_wheel
+
+
+class TestFindLatestWheel(unittest.TestCase):
+    def test_latest(self):
+        with TemporaryDirectory() as td:
+            old = Path(td) / "a-1.0-py3-none-any.whl"
+            new = Path(td) / "a-2.0-py3-none-any.whl"
+            other = Path(td) / "a-3.0.tar.gz"
+            for i, f in enumerate((old, new, other)):
+                f.write_bytes(b'')
+                os.utime(f, (1000 + i, 1000 + i))
+
+            self.assertEqual(find_latest_wheel(td), str(new))
+
+    def test_not_found(self):
+        with TemporaryDirectory() as td:
+            with self.assertRaises(FileNotFoundError):
+                find_latest_wheel(td)
+
+
+class TestBuiltWheel(unittest.TestCase):
+    def test_reported(self):
+        with TemporaryDirectory() as td:
+            whl = Path(td) / "a-1.0-py3-none-any.whl"
+            whl.write_bytes(b'')
+            output = ("* Building wheel...\n"
+                      "Successfully built a-1.0.tar.gz and "
+                      "a-1.0-py3-none-any.whl\n")
+            self.assertEqual(built_wheel(output, td), str(whl))
+
+    def test_not_reported(self):
+        with TemporaryDirectory() as td:
+            self.assertIsNone(built_wheel("* Building wheel...\n", td))
+            # reported, but missing
+            self.assertIsNone(built_wheel(
+                "Successfully built a-1.0-py3-none-any.whl\n", td))
@@ -1,7 +1,7 @@
 import sys
 import unittest
 
-from chkpkg._require_pytyped import get_module_path
+from chkpkg._require_pytyped import get_module_path, find_pytyped
 
 
 class TestGetModulePath(unittest.TestCase):
@@ -11,3 +11,12 @@ class TestGetModulePath(unittest.TestCase):
         # .../site-packages/urllib3/__init__.py
         self.assertTrue(p.exists())
         self.assertTrue(p.is_file())
+
+
+class TestFindPytyped(unittest.TestCase):
+    def test(self):
+        p, exists = find_pytyped(sys.executable, 'json')
+        self.assertEqual(p.name, 'py.typed')
+        self.assertEqual(p.parent, get_module_path(sys.executable,
+                                                   'json').parent)
+        self.assertFalse(exists)
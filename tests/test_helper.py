@@ -0,0 +1,92 @@
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+from chkpkg import Package, CodeExecutionFailed
+from chkpkg._helper import PythonHelper
+from chkpkg._package import Runner
+
+
+class TestPythonHelper(unittest.TestCase):
+    def test_run(self):
+        with TemporaryDirectory() as td:
+            helper = PythonHelper(sys.executable, cwd=td)
+            try:
+                self.assertEqual(helper.run("print('hi')"), (0, 'hi\n'))
+                # each code gets a fresh namespace
+                self.assertEqual(helper.run("x = 1")[0], 0)
+                self.assertEqual(helper.run("print(x)")[0], 1)
+                self.assertEqual(helper.run("import sys; sys.exit(5)"),
+                                 (5, ''))
+                # the interpreter is restarted after it exits
+                self.assertEqual(helper.run("import os; os._exit(3)"),
+                                 (3, ''))
+                self.assertEqual(helper.run("print(2)"), (0, '2\n'))
+            finally:
+                helper.close()
+
+    def test_fds_do_not_break_protocol(self):
+        with TemporaryDirectory() as td:
+            helper = PythonHelper(sys.executable, cwd=td)
+            try:
+                # the child process and sys.__stdout__ write to fd 1,
+                # which is not the reply stream
+                status, _ = helper.run(
+                    "import subprocess, sys\n"
+                    "subprocess.run([sys.executable, '-c', 'print(1)'])\n"
+                    "sys.__stdout__.write('raw')\n"
+                    "sys.__stdout__.flush()")
+                self.assertEqual(status, 0)
+                self.assertEqual(helper.run("print('next')"), (0, 'next\n'))
+                # stdin is empty instead of the protocol stream
+                status, output = helper.run("input()")
+                self.assertEqual(status, 1)
+                self.assertIn('EOFError', output)
+                self.assertEqual(helper.run("print(2)"), (0, '2\n'))
+            finally:
+                helper.close()
+
+
+class PackageTestCase(unittest.TestCase):
+    def setUp(self):
+        # running the code needs only an interpreter, so the package is not
+        # built: the current interpreter plays the installer venv
+        self.pkg = Package()
+        self.pkg._installer = Runner(sys.executable, at='test')
+
+    def tearDown(self):
+        self.pkg.cleanup()
+
+
+class TestRunPythonCodeMany(PackageTestCase):
+    def test_order(self):
+        codes = [f"import time; time.sleep({0.05 * (5 - i)}); print({i})"
+                 for i in range(6)]
+        self.assertEqual(self.pkg.run_python_code_many(codes, workers=3),
+                         [str(i) for i in range(6)])
+
+    def test_child_process(self):
+        outputs = self.pkg.run_python_code_many(
+            ["import os; os.system('echo child')",
+             "print(1)",
+             "print(2)"], workers=2)
+        self.assertEqual(outputs, ['', '1', '2'])
+
+    def test_failure(self):
+        with self.assertRaises(CodeExecutionFailed):
+            self.pkg.run_python_code_many(["print(1)", "raise ValueError"])
+        # the helpers still work
+        self.assertEqual(self.pkg.run_python_code_many(["print(3)"]), ['3'])
+
+
+class TestRunPythonBatch(PackageTestCase):
+    def test_outputs(self):
+        self.assertEqual(
+            self.pkg.run_python_batch(
+                ["import sys; print(1, file=sys.stderr)", "print(2)"]),
+            ['1', '2'])
+
+    def test_exit_zero(self):
+        with self.assertRaises(CodeExecutionFailed):
+            self.pkg.run_python_batch(
+                ["print(1)", "import sys; sys.exit(0)", "print(3)"])
@@ -0,0 +1,48 @@
+import io
+import json
+import unittest
+from unittest import mock
+
+from chkpkg import CodeExecutionFailed, PytypedNotFound
+from chkpkg.serve import serve
+
+
+class FakePackage:
+    def __init__(self, project_dir):
+        self.project_dir = project_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def run_python_code(self, code, rstrip=True):
+        if code == 'fail':
+            raise CodeExecutionFailed('the code failed')
+        return 'out: ' + code
+
+    def require_pytyped(self, module):
+        raise PytypedNotFound(f'File "{module}/py.typed" not found')
+
+
+class TestServe(unittest.TestCase):
+    def test(self):
+        requests = io.StringIO(
+            '{"op": "run_python", "code": "x"}\n'
+            '\n'
+            '{"op": "run_python", "code": "fail"}\n'
+            '{"op": "require_pytyped", "module": "m"}\n'
+            '{"op": "nope"}\n')
+        replies = io.StringIO()
+        with mock.patch('chkpkg.serve.Package', FakePackage):
+            serve('.', requests, replies)
+        self.assertEqual(
+            [json.loads(line) for line in replies.getvalue().splitlines()],
+            [{'ok': True, 'output': 'out: x'},
+             {'ok': False, 'error': 'CodeExecutionFailed',
+              'message': 'the code failed\nprocess: None'},
+             {'ok': False, 'error': 'PytypedNotFound',
+              'message': 'File "m/py.typed" not found'},
+             {'ok': False, 'error': 'ValueError',
+              'message': "Unknown op: 'nope'"}])